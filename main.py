@@ -3,37 +3,77 @@ AI Agent: optimized for low-memory (7B) models. Ollama + tools + short prompt.
 """
 
 import json
+import os
 import re
+import signal
 import sys
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-from ollama import chat as ollama_chat
 from ollama import Client as OllamaClient
 
+try:
+    import orjson as _json_impl  # optional: faster parsing of tool-call JSON
+except ImportError:
+    _json_impl = json
+
+try:
+    import jiter as _jiter  # optional: incremental (partial) JSON parsing of streamed tool calls
+except ImportError:
+    _jiter = None
+
 from memory import MemoryBank
-from tools import AVAILABLE_TOOLS
+from tools import AVAILABLE_TOOLS, OK as TOOL_OK, read_file_nowait
 
 
 # ---- Constants (tuned for 7B) ----
+_DEBUG = os.environ.get("KYROZEN_DEBUG") == "1"  # prompt previews + raw replies on stderr
 MODEL_NAME = "qwen2.5-coder:7b"
 SHORT_TERM_CAP = 8  # fewer turns to save context window
+SLICE_N = SHORT_TERM_CAP * 2  # messages (user + assistant) kept per request
+HISTORY_CHAR_BUDGET = 8000  # cap on history content per request (prefill cost grows with prompt size)
 MAX_TOOL_RETRIES = 3
+KEEP_ALIVE = "30m"  # keep the model (and its prompt KV cache) loaded between turns
+# Fixed context window for every call: a request with a different num_ctx makes Ollama reload
+# the model, which discards its prompt KV cache.
+NUM_CTX = 4096
+# Constrain tool-calling replies to TOOL_CALL_SCHEMA (Ollama structured outputs) instead of
+# freeform "Thought/Action" text + regex. Opt-in (KYROZEN_STRUCTURED=1): replies are then raw JSON,
+# not streamed prose.
+STRUCTURED_TOOL_CALLS = os.environ.get("KYROZEN_STRUCTURED") == "1"
+REPLY_ACTION = "reply"  # structured mode: answer the user directly, no tool
+# Read-only tools: the reply keeps streaming while they run instead of being cut off.
+PARALLEL_SAFE_TOOLS = frozenset({"search_web", "read_file"})
 
 
 def _build_tools_list() -> str:
     """Build tools list for system prompt: name + docstring."""
-    lines = []
-    for name, fn in AVAILABLE_TOOLS.items():
-        doc = getattr(fn, "__doc__", None) or ""
-        desc = doc.strip().replace("\n", " ").strip()
-        lines.append(f"- {name}: {desc}")
-    return "\n".join(lines)
+    return "\n".join(
+        f"- {name}: {(fn.__doc__ or '').strip().replace(chr(10), ' ')}"
+        for name, fn in AVAILABLE_TOOLS.items()
+    )
 
 
 TOOLS_LIST = _build_tools_list()
+# Membership test for parsed actions; dispatch itself still goes through AVAILABLE_TOOLS.
+_TOOL_NAMES = frozenset(sys.intern(name) for name in AVAILABLE_TOOLS)
+
 
+def _system_prompt(tools_list: str, structured: bool = False) -> str:
+    """Minimalist system prompt for 7B models (no external files). structured: JSON-only replies."""
+    if structured:
+        return f"""You are a helpful AI Assistant with access to tools.
+
+## Tools Available:
+{tools_list}
 
-def _system_prompt(tools_list: str) -> str:
-    """Minimalist system prompt for 7B models (no external files)."""
+## Instructions:
+Reply with a single JSON object with "thought", "action" and "args".
+To use a tool, set "action" to the tool name and "args" to its arguments.
+If no tool is needed, use action "{REPLY_ACTION}" and put your answer in args.
+"""
     return f"""You are a helpful AI Assistant with access to tools.
 
 ## Tools Available:
@@ -56,136 +96,540 @@ ALWAYS start with "Thought:" if you are solving a task.
 """
 
 
-# ---- Shared state ----
-ollama = OllamaClient()
-memory_bank = MemoryBank()
-short_term_memory: list[dict[str, str]] = [
-    {"role": "user", "content": "Hello, are you ready to help me?"},
-    {"role": "assistant", "content": "Yes! I can use tools like search_web and write_file. How can I help?"},
-]
+# Tools and template never change at runtime: build the system prompt once.
+SYSTEM_PROMPT = _system_prompt(TOOLS_LIST, STRUCTURED_TOOL_CALLS)
 
+TOOL_CALL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "action": {"enum": [*AVAILABLE_TOOLS, REPLY_ACTION]},
+        "args": {"type": "string"},
+    },
+    "required": ["thought", "action", "args"],
+}
+# Retry prompts repeat the reply format; structured replies are already held to the schema.
+_RETRY_FORMAT = "" if STRUCTURED_TOOL_CALLS else " (output Thought then JSON)"
+# Shared by every request: the first message is the same object (and bytes) each turn.
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
 
-def _build_messages(user_input: str) -> list[dict[str, str]]:
-    """Build message list: system (minimal) + optional memory + last N turns + user."""
-    messages: list[dict[str, str]] = []
 
-    # 1. Single minimal system prompt (no file I/O)
-    messages.append({"role": "system", "content": _system_prompt(TOOLS_LIST)})
-
-    # 2. Optional: one short memory hint if we have RAG results (saves tokens)
-    recalled = memory_bank.recall(user_input, n_results=2)
-    if recalled:
-        memory_block = "Relevant past context:\n" + "\n".join(recalled[:2])
-        messages.append({"role": "system", "content": memory_block})
+# ---- Shared state ----
+_TOOL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tool")
+ollama = OllamaClient()  # one client for all calls: its HTTP connection pool is reused (keep-alive)
+# Chroma and its embedding model load on a pool thread while the first prompt is shown.
+_memory_bank_loading = _TOOL_POOL.submit(MemoryBank)
+# Bounded: appends are O(1) and turns older than the last SLICE_N messages are evicted.
+short_term_memory: deque[dict[str, str]] = deque(
+    [
+        {"role": "user", "content": "Hello, are you ready to help me?"},
+        {"role": "assistant", "content": "Yes! I can use tools like search_web and write_file. How can I help?"},
+    ],
+    maxlen=SLICE_N,
+)
+history_summary = ""  # one-line digest of the conversation, refreshed on /save
+
+
+def _memory_bank() -> MemoryBank:
+    """Long-term memory; the first call waits for the background load to finish."""
+    return _memory_bank_loading.result()
+
+
+def _budgeted_history() -> tuple[list[dict[str, str]], bool]:
+    """Newest of the last N turns that fit HISTORY_CHAR_BUDGET; also whether older messages were left out."""
+    recent = list(short_term_memory)
+    used = 0
+    start = len(recent)
+    while start > 0:
+        size = len(recent[start - 1].get("content", ""))
+        if used + size > HISTORY_CHAR_BUDGET:
+            break
+        used += size
+        start -= 1
+    # A full deque has (most likely) evicted older turns as well.
+    return recent[start:], start > 0 or len(recent) == short_term_memory.maxlen
 
-    # 3. Last N turns
-    for msg in short_term_memory[-SHORT_TERM_CAP * 2 :]:
-        messages.append(msg)
 
-    # 4. Current user input
+def _build_messages(user_input: str, recalled: list[str] | None = None) -> list[dict[str, str]]:
+    """
+    Build message list: system (minimal) + last N turns + user (with optional memory block).
+    Per-turn content comes last, inside the user message, so the system + history prefix
+    stays byte-identical across turns and Ollama can reuse its cached KV state for it.
+    """
+    # 1. Single minimal system prompt (no file I/O, prebuilt at import)
+    messages: list[dict[str, str]] = [_SYSTEM_MESSAGE]
+
+    # 2. Last N turns, within the character budget
+    history, trimmed = _budgeted_history()
+    messages.extend(history)
+
+    # 3. Current user input, prefixed by one short memory hint if we have RAG results (saves tokens)
+    #    and the conversation digest when older turns did not fit the budget
+    memory_lines: list[str] = []
+    if trimmed and history_summary:
+        memory_lines.append(f"Earlier in this conversation: {history_summary}")
+    if recalled:
+        memory_lines.append("Relevant past context:\n" + "\n".join(recalled[:2]))
+    if memory_lines:
+        user_input = "\n".join(memory_lines) + "\n\n" + user_input
     messages.append({"role": "user", "content": user_input})
 
     return messages
 
 
+# Tool-call block: optional "Action:" label, then a fenced (json) code block.
+_ACTION_RE = re.compile(r"(?:Action:\s*)?```(?:json)?\s*([\s\S]*?)\s*```", re.IGNORECASE)
+
+
+def _iter_tool_calls(text: str):
+    """Yield the tool-call JSON of every valid ```json ... ``` block (optionally after 'Action:'), in order."""
+    # Cheap substring test first: plain prose replies never reach the regex engine.
+    if not text or "```" not in text:
+        return
+    for code_match in _ACTION_RE.finditer(text):
+        raw = code_match.group(1).strip()
+        # Ordinary code blocks (python, shell, ...) are skipped without raising a decode error.
+        if not (raw.startswith("{") and raw.endswith("}")):
+            continue
+        try:
+            data = _json_impl.loads(raw)
+        except ValueError:  # json.JSONDecodeError / orjson.JSONDecodeError
+            continue
+        if isinstance(data, dict) and "action" in data and data.get("action") in _TOOL_NAMES:
+            yield data
+
+
+def _tool_args(call: dict) -> str:
+    """A tool call's args as the string tools take; an object/array (e.g. for write_files) as JSON."""
+    args = call.get("args", "")
+    if isinstance(args, str):
+        return args
+    if isinstance(args, (dict, list)):
+        return json.dumps(args, ensure_ascii=False)
+    return "" if args is None else str(args)
+
+
 def parse_json_from_response(text: str) -> dict | None:
     """
-    Extract tool-call JSON. Prefer 'Action: ```json ... ```' then any ```json ... ``` block.
+    Extract tool-call JSON from the first valid ```json ... ``` block (optionally after 'Action:').
     """
-    text = (text or "").strip()
-    # Prefer pattern: Action: ```json ... ```
-    for pattern in (
-        r"Action:\s*```(?:json)?\s*([\s\S]*?)\s*```",
-        r"```(?:json)?\s*([\s\S]*?)\s*```",
-    ):
-        code_match = re.search(pattern, text)
-        if code_match:
-            raw = code_match.group(1).strip()
-            try:
-                data = json.loads(raw)
-                if isinstance(data, dict) and "action" in data and data.get("action") in AVAILABLE_TOOLS:
-                    return data
-            except json.JSONDecodeError:
-                continue
-    return None
+    return next(_iter_tool_calls(text), None)
+
+
+def _extra_read_calls(text: str, first: dict) -> list[dict]:
+    """
+    Further distinct read-only (PARALLEL_SAFE_TOOLS) calls in a reply besides its first tool call.
+    Calls are told apart by (action, args) only: first may be a partial parse without later keys.
+    """
+    seen = {(first.get("action"), _tool_args(first))}
+    calls: list[dict] = []
+    for call in _iter_tool_calls(text):
+        key = (call["action"], _tool_args(call))
+        if call["action"] in PARALLEL_SAFE_TOOLS and key not in seen:
+            seen.add(key)
+            calls.append(call)
+    return calls
 
 
-def _run_tool(action: str, args: str) -> str:
-    """Execute one tool; return result string."""
+# Successful results of read-only tools (PARALLEL_SAFE_TOOLS) within the current user turn:
+# retries often repeat a call. Cleared per turn and whenever another tool may have changed state.
+_tool_memo: dict[tuple[str, str], tuple[bool, str]] = {}
+
+
+def _run_tool(action: str, args: str) -> tuple[bool, str]:
+    """Execute one tool; return (ok, result string)."""
     fn = AVAILABLE_TOOLS.get(action)
     if not fn:
-        return f"Error: unknown tool '{action}'"
+        return False, f"Error: unknown tool '{action}'"
+    key = (action, args)
+    read_only = action in PARALLEL_SAFE_TOOLS
+    if read_only:
+        hit = _tool_memo.get(key)
+        if hit:
+            return hit
+    else:
+        _tool_memo.clear()
     try:
-        return str(fn(args))
+        status, result = fn(args)
     except Exception as e:
-        return f"Error: {e}"
+        return False, f"Error: {e}"
+    outcome = status == TOOL_OK, str(result)
+    if read_only and outcome[0]:
+        _tool_memo[key] = outcome
+    return outcome
 
 
-def _get_llm_response(messages: list[dict[str, str]]) -> str:
-    """Call Ollama; return assistant content. Debug-prints messages."""
-    print("[DEBUG] Messages sent to ollama.chat:")
-    for i, m in enumerate(messages):
-        role = m.get("role", "?")
-        content = m.get("content", "")
-        preview = content[:80] + "..." if len(content) > 80 else content
-        print(f"  [{i}] role={role!r} content={preview!r}")
-    print()
+def _submit_tool(action: str, args: str) -> Future:
+    """
+    Run a tool on _TOOL_POOL. A read_file whose data is already in the page cache is served
+    on the calling thread instead (it cannot block), skipping the hand-off to a worker.
+    """
+    if action == "read_file":
+        outcome = read_file_nowait(args)
+        if outcome is not None:
+            future: Future = Future()
+            future.set_result((outcome[0] == TOOL_OK, outcome[1]))
+            return future
+    return _TOOL_POOL.submit(_run_tool, action, args)
+
+
+def _run_tools(calls: list[dict]) -> list[Future]:
+    """Dispatch independent tool calls at once; futures in call order."""
+    return [_submit_tool(call["action"], _tool_args(call)) for call in calls]
+
+
+def _stream_llm_response(messages: list[dict[str, str]], fmt: dict | None = None):
+    """Stream the assistant reply from Ollama; yield content deltas as they arrive. fmt: JSON schema."""
+    stream = None
     try:
-        response = ollama_chat(model=MODEL_NAME, messages=messages)
-        return (response.message and getattr(response.message, "content", None)) or ""
+        stream = ollama.chat(
+            model=MODEL_NAME,
+            messages=messages,
+            stream=True,
+            format=fmt,
+            keep_alive=KEEP_ALIVE,
+            options={"num_ctx": NUM_CTX},
+        )
+        for chunk in stream:
+            message = chunk["message"]
+            delta = (message and message["content"]) or ""
+            if delta:
+                yield delta
     except Exception as e:
-        return f"[LLM Error] {e}"
+        yield f"[LLM Error] {e}"
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+
+def _partial_tool_call(text: str) -> dict | None:
+    """
+    Parse the (possibly unfinished) JSON block of a streaming reply with jiter.
+    Returns the tool call as soon as a known action and a complete string args are present.
+    """
+    fence = text.find("```")
+    if fence < 0:
+        return None
+    brace = text.find("{", fence)
+    if brace < 0:
+        return None
+    try:
+        data = _jiter.from_json(text[brace:].encode(), partial_mode="on")
+    except ValueError:
+        return None
+    if (
+        isinstance(data, dict)
+        and data.get("action") in _TOOL_NAMES
+        and isinstance(data.get("args"), str)
+    ):
+        return data
+    return None
+
+
+class _ToolCallScanner:
+    """
+    Early tool-call detection without jiter: tracks brace depth (skipping JSON strings) over each
+    new delta only, and parses the first object after a code fence once its closing brace arrives.
+    """
+
+    def __init__(self) -> None:
+        self._text = ""
+        self._fence = -1
+        self._start = -1  # opening brace of the object
+        self._pos = 0  # next index to scan
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._done = False
+
+    def feed(self, delta: str) -> dict | None:
+        """Append a delta; return the tool call once the object is complete and valid."""
+        if self._done:
+            return None
+        self._text += delta
+        text = self._text
+        if self._fence < 0:
+            self._fence = text.find("```", max(len(text) - len(delta) - 2, 0))
+            if self._fence < 0:
+                return None
+            self._pos = self._fence + 3
+        if self._start < 0:
+            brace = text.find("{", self._pos)
+            if brace < 0:
+                self._pos = len(text)
+                return None
+            self._start, self._depth, self._pos = brace, 1, brace + 1
+        # Per-character loop: state lives in locals and is written back once.
+        depth, in_string, escape = self._depth, self._in_string, self._escape
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    self._done = True
+                    return self._tool_call(text[self._start : i + 1])
+        self._depth, self._in_string, self._escape = depth, in_string, escape
+        self._pos = len(text)
+        return None
+
+    @staticmethod
+    def _tool_call(raw: str) -> dict | None:
+        try:
+            data = _json_impl.loads(raw)
+        except ValueError:
+            return None
+        if (
+            isinstance(data, dict)
+            and data.get("action") in _TOOL_NAMES
+            and isinstance(data.get("args"), str)
+        ):
+            return data
+        return None
+
+
+def _debug_messages(messages: list[dict[str, str]]) -> None:
+    """Write a one-line preview per message to stderr in a single write."""
+    previews = [
+        f"  [{i}] role={m.get('role', '?')!r} "
+        f"content={(c[:80] + '...') if len(c := m.get('content', '')) > 80 else c!r}"
+        for i, m in enumerate(messages)
+    ]
+    sys.stderr.write("[DEBUG] Messages sent to ollama.chat:\n" + "\n".join(previews) + "\n\n")
+
+
+def _stream_reply(
+    messages: list[dict[str, str]],
+    detect_tool: bool = False,
+    cancel: threading.Event | None = None,
+) -> tuple[str, dict | None, Future | None]:
+    """
+    Call Ollama and echo tokens as they stream. Debug-prints messages.
+    With detect_tool, a tool call is dispatched on _TOOL_POOL as soon as it has been emitted;
+    returns (text, tool_call, future) where tool_call/future are None when not detected early.
+    The stream is then cut off, except for PARALLEL_SAFE_TOOLS which run alongside the rest of it.
+    With cancel (speculative run): no echo and no dispatch, and the stream stops once cancel is set.
+    """
+    if _DEBUG:
+        _debug_messages(messages)
+    echo = cancel is None
+    parts: list[str] = []
+    tool_call = None
+    pending = None
+    # Without jiter, a brace-counting scanner finds the end of the tool-call object instead.
+    scanner = _ToolCallScanner() if detect_tool and _jiter is None else None
+    stream = _stream_llm_response(messages)
+    # Hot per-token loop: bind the bound methods once.
+    out_write, out_flush, append = sys.stdout.write, sys.stdout.flush, parts.append
+    for delta in stream:
+        if cancel is not None and cancel.is_set():
+            stream.close()
+            break
+        if echo:
+            out_write(delta)
+            out_flush()
+        append(delta)
+        if detect_tool and tool_call is None:
+            if scanner is not None:
+                tool_call = scanner.feed(delta)
+            elif '"' in delta:
+                tool_call = _partial_tool_call("".join(parts))
+            if tool_call:
+                text = "".join(parts)
+                if echo:
+                    pending = _submit_tool(tool_call["action"], tool_call["args"])
+                    if tool_call["action"] in PARALLEL_SAFE_TOOLS:
+                        continue
+                stream.close()
+                if echo:
+                    sys.stdout.write("\n")
+                # Re-emit the truncated block whole so the reply stays well-formed in history.
+                head = text[: text.find("{", text.find("```"))]
+                return f"{head}{json.dumps(tool_call)}\n```", tool_call, pending
+    if parts and echo:
+        sys.stdout.write("\n")
+    return "".join(parts), tool_call, pending
+
+
+def _structured_reply(messages: list[dict[str, str]]) -> tuple[str, dict | None]:
+    """
+    Call Ollama constrained to TOOL_CALL_SCHEMA. Returns (raw JSON, tool call) for a tool action;
+    for REPLY_ACTION echoes and returns (answer, None).
+    """
+    raw = "".join(_stream_llm_response(messages, fmt=TOOL_CALL_SCHEMA)).strip()
+    try:
+        data = _json_impl.loads(raw)
+    except ValueError:
+        return raw, parse_json_from_response(raw)
+    if not isinstance(data, dict):
+        return raw, None
+    if data.get("action") in _TOOL_NAMES:
+        return raw, data
+    answer = str(data.get("args", "")).strip()
+    sys.stdout.write(answer + "\n")
+    return answer, None
+
+
+_EMPTY_REPLY_NUDGE = {
+    "role": "user",
+    "content": (
+        "System: You returned nothing. Please output the JSON object now."
+        if STRUCTURED_TOOL_CALLS
+        else "System: You returned nothing. Please output your Thought and JSON Action now."
+    ),
+}
+
+
+def _next_step(messages: list[dict[str, str]]) -> tuple[str, dict | None, Future | None]:
+    """
+    Get the model's next step: (reply text, tool call or None, future if already dispatched).
+    Only a stream that ended without any content is re-issued, once, with an explicit nudge.
+    """
+    for attempt_msgs in (messages, messages + [_EMPTY_REPLY_NUDGE]):
+        if STRUCTURED_TOOL_CALLS:
+            text, tool_call = _structured_reply(attempt_msgs)
+            pending = None
+        else:
+            text, tool_call, pending = _stream_reply(attempt_msgs, detect_tool=True)
+            text = text.strip()
+            # Prefer the call detected mid-stream; otherwise parse the finished reply.
+            tool_call = tool_call or parse_json_from_response(text)
+        if _DEBUG:
+            sys.stderr.write(f"[DEBUG RAW]: {text!r}\n")
+        if text:
+            break
+        if attempt_msgs is messages:
+            print("[Warning] Empty response. Retrying with explicit instruction...")
+    return text, tool_call, pending
+
+
+def _speculative_step(variants: list[list[dict[str, str]]]) -> tuple[str, dict | None, Future | None]:
+    """
+    Run several prompt variants concurrently and keep the first reply that parses as a tool call
+    (else the first non-empty one); the remaining streams are cancelled. Generation only overlaps
+    when the Ollama server runs with OLLAMA_NUM_PARALLEL > 1; otherwise requests queue up.
+    """
+    if STRUCTURED_TOOL_CALLS:  # schema-constrained replies are always valid calls
+        return _next_step(variants[0])
+    cancel = threading.Event()
+    futures = [
+        _TOOL_POOL.submit(_stream_reply, msgs, detect_tool=True, cancel=cancel) for msgs in variants
+    ]
+    text, tool_call = "", None
+    for future in as_completed(futures):
+        candidate, call, _ = future.result()
+        candidate = candidate.strip()
+        call = call or parse_json_from_response(candidate)
+        if call:
+            text, tool_call = candidate, call
+            break
+        text = text or candidate
+    cancel.set()
+    if _DEBUG:
+        sys.stderr.write(f"[DEBUG RAW]: {text!r}\n")
+    sys.stdout.write(text + "\n")
+    return text, tool_call, None
+
+
+def _prefill(messages: list[dict[str, str]]) -> None:
+    """Have Ollama evaluate (and KV-cache) a prompt while generating only one token; best effort."""
+    try:
+        ollama.chat(
+            model=MODEL_NAME,
+            messages=messages,
+            options={"num_ctx": NUM_CTX, "num_predict": 1},
+            keep_alive=KEEP_ALIVE,
+        )
+    except Exception:
+        pass
+
+
+def _get_llm_response(messages: list[dict[str, str]]) -> str:
+    """
+    Call Ollama; return the full streamed assistant content. In structured mode, the answer of a
+    REPLY_ACTION reply; "" if the model asked for another tool instead.
+    """
+    if STRUCTURED_TOOL_CALLS:
+        text, tool_call = _structured_reply(messages)
+        return "" if tool_call else text
+    return _stream_reply(messages)[0]
 
 
 def _chat_turn(user_input: str) -> str:
-    """One user turn: build context, get LLM reply, handle tool call and retry if empty."""
-    messages = _build_messages(user_input)
-    response_text = _get_llm_response(messages).strip()
-
-    # Robust retry for empty response
-    print(f"[DEBUG RAW]: {repr(response_text)}")
-    if not response_text or not response_text.strip():
-        print("[Warning] Empty response. Retrying with explicit instruction...")
-        messages.append({
-            "role": "user",
-            "content": "System: You returned nothing. Please output your Thought and JSON Action now.",
-        })
-        response_text = _get_llm_response(messages).strip()
-        print(f"[DEBUG RAW]: {repr(response_text)}")
+    """One user turn: build context, get LLM reply (re-asked once if empty), handle tool call."""
+    _tool_memo.clear()
+    # Context (RAG recall + system prompt + history) is built once and shared by every call below.
+    base_msgs = _build_messages(user_input, _memory_bank().recall(user_input, n_results=2))
+    response_text, tool_call, pending = _next_step(base_msgs)
 
     for attempt in range(MAX_TOOL_RETRIES + 1):
-        tool_call = parse_json_from_response(response_text)
         if not tool_call:
             return response_text
 
         action = tool_call.get("action", "")
-        args = tool_call.get("args", "") if isinstance(tool_call.get("args"), str) else str(tool_call.get("args", ""))
-
-        result = _run_tool(action, args)
+        args = _tool_args(tool_call)
+
+        # Prefill the follow-up prompt's prefix on the server while the tool runs.
+        assistant_msg = {"role": "assistant", "content": response_text}
+        _TOOL_POOL.submit(_prefill, base_msgs + [assistant_msg])
+
+        # Further read-only calls in the same reply run alongside the first one when it is
+        # read-only too; after a call with side effects (a write, a command), only once it is done.
+        extra_calls = _extra_read_calls(response_text, tool_call)
+        first_read_only = action in PARALLEL_SAFE_TOOLS
+        extra = _run_tools(extra_calls) if first_read_only else []
+        # Already running if it was dispatched while the reply streamed.
+        ok, result = pending.result() if pending else _run_tool(action, args)
+        if not first_read_only:
+            extra = _run_tools(extra_calls)
+        if extra:
+            outcomes = [(ok, result)] + [future.result() for future in extra]
+            ok = all(outcome_ok for outcome_ok, _ in outcomes)
+            result = "\n\n".join(
+                f"[{call['action']}] {outcome}"
+                for call, (_, outcome) in zip([tool_call, *extra_calls], outcomes)
+            )
 
-        if result.strip().lower().startswith("error") and attempt < MAX_TOOL_RETRIES:
-            retry_messages = _build_messages(user_input)
-            retry_messages.append({
+        if not ok and attempt < MAX_TOOL_RETRIES:
+            retry_hint = {
                 "role": "user",
-                "content": f"Tool failed. Result: {result}. Try again with different action/args (output Thought then JSON).",
-            })
-            response_text = _get_llm_response(retry_messages).strip()
+                "content": f"Tool failed. Result: {result}. Try again with different action/args{_RETRY_FORMAT}.",
+            }
+            # Speculate: ask with and without the failed attempt in context, keep the first valid call.
+            response_text, tool_call, pending = _speculative_step(
+                [base_msgs + [retry_hint], base_msgs + [assistant_msg, retry_hint]]
+            )
             continue
 
         tool_feedback = (
             f"System: Tool executed. Result: {result}. "
             "Summarize what you did for the user."
         )
-        follow_up = _build_messages(user_input)
-        follow_up.append({"role": "assistant", "content": response_text})
-        follow_up.append({"role": "user", "content": tool_feedback})
-        response_text = _get_llm_response(follow_up).strip() or result
+        follow_up = base_msgs + [assistant_msg, {"role": "user", "content": tool_feedback}]
+        response_text = _get_llm_response(follow_up).strip()
+        if not response_text:  # empty summary: the tool result is the reply, and nothing streamed it
+            response_text = result
+            sys.stdout.write(result + "\n")
         break
 
     return response_text
 
 
 def main() -> None:
+    global history_summary
+    if hasattr(signal, "SIGHUP"):  # terminal closed: exit normally, so atexit writes buffered memory
+        signal.signal(signal.SIGHUP, lambda *_: sys.exit(0))
     print("AI Agent (Ollama + Tools). Model:", MODEL_NAME)
     print("Commands: /quit exit, /save save to long-term memory.\n")
 
@@ -202,17 +646,20 @@ def main() -> None:
             print("Goodbye.")
             break
         if user_input.lower() == "/save":
-            memory_bank.add_log(
-                "Conversation: " + "; ".join(
-                    m.get("content", "")[:200] for m in short_term_memory[-6:] if m.get("content")
-                )
-            )
+            last_six = reversed(list(islice(reversed(short_term_memory), 6)))
+            history_summary = "; ".join(m.get("content", "")[:200] for m in last_six if m.get("content"))
+            bank = _memory_bank()
+            bank.add_log("Conversation: " + history_summary)
+            bank.flush()  # written now, not with the next batch
             print("Saved to long-term memory.")
             continue
 
+        print("Agent: ", end="", flush=True)
         reply = _chat_turn(user_input)
+        print()
 
-        print(f"[DEBUG RAW]: {repr(reply)}")
+        if _DEBUG:
+            sys.stderr.write(f"[DEBUG RAW]: {reply!r}\n")
 
         if len(reply.strip()) < 5:
             print("[Error] Received empty response from LLM")
@@ -220,9 +667,7 @@ def main() -> None:
 
         short_term_memory.append({"role": "user", "content": user_input})
         short_term_memory.append({"role": "assistant", "content": reply})
-        memory_bank.add_log(f"User: {user_input}\nAssistant: {reply}")
-
-        print("Agent:", reply, "\n")
+        _memory_bank().add_log(f"User: {user_input}\nAssistant: {reply}")
 
 
 if __name__ == "__main__":
@@ -2,60 +2,350 @@
 Long-term memory for the AI agent using ChromaDB (persistent).
 """
 
+import atexit
+import threading
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import chromadb
-from chromadb.config import Settings
+import numpy as np
 
 
 class MemoryBank:
-    """Stores and retrieves interaction logs using ChromaDB."""
+    """
+    Stores and retrieves interaction logs using ChromaDB.
+    Recall is served by the collection's persistent HNSW index (approximate nearest neighbours),
+    so lookups stay sub-linear as the log grows.
+    """
 
     COLLECTION_NAME = "agent_logs"
     DEFAULT_PATH = "./chroma_memory"
+    # recall() asks for a couple of neighbours; a smaller candidate list than Chroma's
+    # default keeps HNSW search cheap. Applied when the collection is created.
+    HNSW_SEARCH_EF = 32
+    # add_log writes are buffered and embedded/stored together once this many are pending.
+    # Matches the agent's short-term window (8 turns), so a turn is recallable by the time it leaves it.
+    FLUSH_THRESHOLD = 8
+    FLUSH_SECONDS = 2.0  # ...or at most this long after the first of them was queued
+    QUERY_CACHE_SIZE = 256  # recall query embeddings kept for reuse
+    # Semantic recall cache: a query whose embedding is this close (cosine) to a cached one
+    # reuses its results instead of searching again. A write drops only the rows a new log could
+    # enter: those whose query is closer to it than the row's last (n-th) result.
+    SEMANTIC_CACHE_SIZE = 1024
+    SEMANTIC_CACHE_MIN_SIM = 0.95
+    # A new log this similar (cosine) to a stored one is not inserted; the stored entry's
+    # "count" and "timestamp" metadata are bumped instead.
+    DEDUPE_MIN_SIM = 0.95
 
     def __init__(self, path: str | None = None):
+        # Imported here: chromadb takes about half a second to import, paid only when memory is used.
+        import chromadb
+        from chromadb.config import Settings
+        from chromadb.utils import embedding_functions
+
         self._path = path or self.DEFAULT_PATH
         self._client = chromadb.PersistentClient(
             path=self._path,
             settings=Settings(anonymized_telemetry=False),
         )
+        # Chroma's default embedder, held here so writes and queries can be embedded in batches.
+        self._embed = embedding_functions.DefaultEmbeddingFunction()
+        self._query_embeddings: OrderedDict[str, object] = OrderedDict()
+        # Semantic cache rows: unit query vectors, their results (with the cosine similarity of the
+        # n-th one, -inf when fewer were found), and last-use ticks for LRU eviction.
+        self._lock = threading.Lock()
+        self._sem_vecs: np.ndarray | None = None
+        self._sem_results: list[tuple[int, list[str], float]] = []
+        self._sem_used = np.zeros(self.SEMANTIC_CACHE_SIZE, dtype=np.int64)
+        self._sem_tick = 0
+        self._sem_generation = 0  # bumped on every clear, so in-flight results from before a write are not stored
         self._collection = self._client.get_or_create_collection(
             name=self.COLLECTION_NAME,
-            metadata={"description": "Agent interaction logs"},
+            embedding_function=self._embed,
+            metadata={"description": "Agent interaction logs", "hnsw:search_ef": self.HNSW_SEARCH_EF},
         )
+        # Entry count kept locally (recall clamps n_results to it) instead of a count() query per recall.
+        self._count = self._collection.count()
+        # Log IDs are "log_<n>" from a counter taken under _lock; deduplicated or failed writes
+        # leave gaps, so it resumes after the highest stored number rather than the entry count.
+        self._next_id = self._next_log_number()
+        # Query distance below which a log counts as a duplicate. Chroma's default "l2" space is the
+        # squared distance (2 - 2*cos for the unit-length default embeddings); cosine/ip give 1 - cos.
+        space = (self._collection.metadata or {}).get("hnsw:space", "l2")
+        self._dist_scale = 2.0 if space == "l2" else 1.0  # query distance = scale * (1 - cos)
+        self._dedupe_max_dist = self._dist_scale * (1.0 - self.DEDUPE_MIN_SIM)
+        self._buffer: list[tuple[str, str, dict]] = []
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-writer")
+        atexit.register(self.flush)
+
+    def _next_log_number(self) -> int:
+        """One past the highest n among stored "log_<n>" IDs (0 for an empty collection)."""
+        if not self._count:
+            return 0
+        numbers = [
+            int(log_id[4:])
+            for log_id in self._collection.get(include=[])["ids"]
+            if log_id.startswith("log_") and log_id[4:].isdigit()
+        ]
+        return max(numbers, default=-1) + 1
 
     def add_log(self, text: str) -> str:
-        """Save a text log with a timestamp-based ID. Returns the assigned ID."""
-        log_id = f"{datetime.utcnow().isoformat()}Z_{uuid.uuid4().hex[:8]}"
+        """
+        Queue a text log with a sequential ID; returns the assigned ID right away.
+        Logs are embedded and written in batches of FLUSH_THRESHOLD on a background thread,
+        or FLUSH_SECONDS after the first buffered one if fewer arrive.
+        """
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            log_id = f"log_{self._next_id}"
+            self._next_id += 1
+            self._buffer.append((log_id, text, {"timestamp": now}))
+            if len(self._buffer) < self.FLUSH_THRESHOLD:
+                if len(self._buffer) == 1:
+                    timer = threading.Timer(self.FLUSH_SECONDS, self._flush_in_background)
+                    timer.daemon = True
+                    timer.start()
+                return log_id
+            batch, self._buffer = self._buffer, []
+        self._writer.submit(self._write_batch, batch)
+        return log_id
+
+    def _flush_in_background(self) -> None:
+        """Timer callback: hand whatever is buffered to the writer thread."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._writer.submit(self._write_batch, batch)
+
+    def flush(self) -> None:
+        """Write any buffered logs now, on the calling thread (also registered to run at exit)."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list[tuple[str, str, dict]]) -> None:
+        """
+        Store buffered logs with one collection write (one embedding forward pass).
+        Near-duplicates of stored logs only bump the stored entry's metadata.
+        """
         try:
-            self._collection.add(
-                ids=[log_id],
-                documents=[text],
-                metadatas=[{"timestamp": datetime.utcnow().isoformat()}],
-            )
+            embeddings = self._embed([text for _, text, _ in batch])
+            batch, embeddings = self._drop_duplicates(batch, embeddings)
+            written = len(batch)
+            if batch:
+                ids, texts, metadatas = (list(col) for col in zip(*batch))
+                self._collection.add(
+                    ids=ids,
+                    documents=texts,
+                    embeddings=embeddings,
+                    metadatas=metadatas,
+                )
+        except Exception:
+            # Fall back to one-by-one writes so a single bad entry does not lose the batch.
+            written = sum(self._write_one(*entry) for entry in batch)
+            embeddings = None
+        with self._lock:
+            self._count += written
+        if not written:  # all deduplicated (metadata bumps only): cached results still hold
+            return
+        if embeddings is None:
+            self._clear_semantic_cache()
+        else:
+            self._invalidate_semantic_cache(embeddings)
+
+    def _drop_duplicates(self, batch: list[tuple[str, str, dict]], embeddings) -> tuple[list, list]:
+        """
+        Split off logs whose nearest stored neighbour is within the dedupe distance, bumping that
+        neighbour's count/timestamp. Returns the remaining entries and their embeddings.
+        """
+        if not self._count:
+            return batch, list(embeddings)
+        result = self._collection.query(
+            query_embeddings=list(embeddings),
+            n_results=1,
+            include=["metadatas", "distances"],
+        )
+        keep, keep_embeddings = [], []
+        bumped: dict[str, dict] = {}
+        for entry, embedding, ids, dists, metas in zip(
+            batch, embeddings, result["ids"], result["distances"], result["metadatas"]
+        ):
+            if ids and dists[0] < self._dedupe_max_dist:
+                meta = bumped.get(ids[0]) or dict(metas[0] or {})
+                meta["count"] = meta.get("count", 1) + 1
+                meta["timestamp"] = entry[2]["timestamp"]
+                bumped[ids[0]] = meta
+            else:
+                keep.append(entry)
+                keep_embeddings.append(embedding)
+        if bumped:
+            self._collection.update(ids=list(bumped), metadatas=list(bumped.values()))
+        return keep, keep_embeddings
+
+    def _write_one(self, log_id: str, text: str, metadata: dict) -> int:
+        """Store a single log; on failure store an error note instead. Returns the entries added."""
+        try:
+            self._collection.add(ids=[log_id], documents=[text], metadatas=[metadata])
         except Exception as e:
-            log_id = f"err_{uuid.uuid4().hex[:8]}"
-            self._collection.add(
-                ids=[log_id],
-                documents=[f"[add_log error] {text} (error: {e})"],
-                metadatas=[{"timestamp": datetime.utcnow().isoformat()}],
-            )
-        return log_id
+            try:
+                self._collection.add(
+                    ids=[f"err_{uuid.uuid4().hex[:8]}"],
+                    documents=[f"[add_log error] {text} (error: {e})"],
+                    metadatas=[metadata],
+                )
+            except Exception:
+                return 0
+        return 1
+
+    def _embed_queries(self, queries: list[str]) -> list:
+        """
+        Embeddings for recall queries; cached, since the same query is often looked up again.
+        Queries not in the cache are embedded together in one batch.
+        """
+        cache = self._query_embeddings
+        missing = [query for query in dict.fromkeys(queries) if query not in cache]
+        if missing:
+            cache.update(zip(missing, self._embed(missing)))
+        embeddings = []
+        for query in queries:
+            cache.move_to_end(query)
+            embeddings.append(cache[query])
+        while len(cache) > self.QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
+        return embeddings
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        """Unit-length float32 copy of an embedding (semantic cache key)."""
+        unit = np.asarray(embedding, dtype=np.float32)
+        return unit / (np.linalg.norm(unit) or 1.0)
+
+    def _clear_semantic_cache(self) -> None:
+        """Drop cached recall results; called after writes, which can change any result."""
+        with self._lock:
+            self._sem_results.clear()
+            self._sem_generation += 1
+
+    def _invalidate_semantic_cache(self, embeddings) -> None:
+        """Drop the cached results that newly added logs (embeddings) could now appear in."""
+        with self._lock:
+            self._sem_generation += 1
+            size = len(self._sem_results)
+            if not size:
+                return
+            new = np.stack([self._unit(embedding) for embedding in embeddings])
+            if new.shape[1] != self._sem_vecs.shape[1]:
+                self._sem_results.clear()
+                return
+            closest = (self._sem_vecs[:size] @ new.T).max(axis=1)
+            last_sim = np.array([row[2] for row in self._sem_results], dtype=np.float32)
+            keep = np.flatnonzero(closest < last_sim)
+            if len(keep) == size:
+                return
+            self._sem_vecs[: len(keep)] = self._sem_vecs[keep]
+            self._sem_used[: len(keep)] = self._sem_used[keep]
+            self._sem_results[:] = [self._sem_results[row] for row in keep]
+
+    def _last_sim(self, dists: list[float] | None, n_results: int) -> float:
+        """Cosine similarity of the n-th result from query distances; -inf if fewer were found."""
+        if not dists or len(dists) < n_results:
+            return float("-inf")
+        return 1.0 - dists[-1] / self._dist_scale
+
+    def _semantic_lookup(self, unit: np.ndarray, n_results: int) -> list[str] | None:
+        """Cached results for a query within SEMANTIC_CACHE_MIN_SIM of a previous one, else None."""
+        with self._lock:
+            size = len(self._sem_results)
+            if not size:
+                return None
+            sims = self._sem_vecs[:size] @ unit
+            row = int(sims.argmax())
+            cached_n, docs, _ = self._sem_results[row]
+            if sims[row] < self.SEMANTIC_CACHE_MIN_SIM or cached_n != n_results:
+                return None
+            self._sem_tick += 1
+            self._sem_used[row] = self._sem_tick
+            return list(docs)
+
+    def _semantic_store(
+        self, unit: np.ndarray, n_results: int, docs: list[str], last_sim: float, generation: int
+    ) -> None:
+        """Cache results for a query vector, evicting the least recently used row when full."""
+        with self._lock:
+            if generation != self._sem_generation:
+                return
+            if self._sem_vecs is None or self._sem_vecs.shape[1] != unit.shape[0]:
+                self._sem_vecs = np.empty((self.SEMANTIC_CACHE_SIZE, unit.shape[0]), dtype=np.float32)
+                self._sem_results.clear()
+            size = len(self._sem_results)
+            if size < self.SEMANTIC_CACHE_SIZE:
+                row = size
+                self._sem_results.append((n_results, docs, last_sim))
+            else:
+                row = int(self._sem_used.argmin())
+                self._sem_results[row] = (n_results, docs, last_sim)
+            self._sem_vecs[row] = unit
+            self._sem_tick += 1
+            self._sem_used[row] = self._sem_tick
 
     def recall(self, query: str, n_results: int = 2) -> list[str]:
         """Retrieve the top n_results most relevant logs for the query."""
         if not query or not query.strip():
             return []
         try:
+            embedding = self._embed_queries([query.strip()])[0]
+            unit = self._unit(embedding)
+            cached = self._semantic_lookup(unit, n_results)
+            if cached is not None:
+                return cached
+            generation = self._sem_generation
             result = self._collection.query(
-                query_texts=[query.strip()],
-                n_results=min(n_results, self._collection.count() or 1),
+                query_embeddings=[embedding],
+                n_results=min(n_results, self._count or 1),
             )
             docs = result.get("documents")
             if docs and len(docs) > 0:
-                return list(docs[0]) if isinstance(docs[0], list) else [docs[0]]
-            return []
+                found = list(docs[0]) if isinstance(docs[0], list) else [docs[0]]
+            else:
+                found = []
+            dists = (result.get("distances") or [None])[0]
+            self._semantic_store(unit, n_results, found, self._last_sim(dists, n_results), generation)
+            return found
         except Exception:
             return []
+
+    def recall_many(self, queries: list[str], n_results: int = 2) -> list[list[str]]:
+        """
+        recall() for a batch of queries (e.g. replaying queued inputs): one embedding pass and
+        one collection query cover every query the semantic cache does not answer.
+        """
+        found: list[list[str]] = [[] for _ in queries]
+        pending = [(i, query.strip()) for i, query in enumerate(queries) if query and query.strip()]
+        if not pending:
+            return found
+        try:
+            embeddings = self._embed_queries([query for _, query in pending])
+            misses = []
+            for (i, _), embedding in zip(pending, embeddings):
+                unit = self._unit(embedding)
+                cached = self._semantic_lookup(unit, n_results)
+                if cached is None:
+                    misses.append((i, embedding, unit))
+                else:
+                    found[i] = cached
+            if misses:
+                generation = self._sem_generation
+                result = self._collection.query(
+                    query_embeddings=[embedding for _, embedding, _ in misses],
+                    n_results=min(n_results, self._count or 1),
+                )
+                distances = result.get("distances") or [None] * len(misses)
+                for (i, _, unit), docs, dists in zip(misses, result.get("documents") or [], distances):
+                    found[i] = list(docs)
+                    last_sim = self._last_sim(dists, n_results)
+                    self._semantic_store(unit, n_results, found[i], last_sim, generation)
+        except Exception:
+            pass
+        return found
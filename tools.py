@@ -2,12 +2,27 @@
 Agent capabilities: file I/O, shell commands, web search.
 """
 
+import codecs
+import json
+import mmap
 import os
 import subprocess
 import re
-from typing import Any
+import select
+import shlex
+import shutil
+import signal
+import stat
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Mapping
 
-from duckduckgo_search import DDGS
+
+# ---- Tool result status: every tool returns (status, text) ----
+# The retry loop checks the status code instead of scanning the (possibly large) text.
+OK, ERR, BLOCKED = 0, 1, 2
 
 
 # ---- Safety: block dangerous shell commands ----
@@ -25,33 +40,299 @@ _BLOCKED_PATTERNS = [
 _BLOCKED_RE = re.compile("|".join(_BLOCKED_PATTERNS), re.IGNORECASE)
 
 
+def _compile_blocked_db():
+    """
+    Compile the blocklist into a single Hyperscan database (one linear-time scan, no backtracking).
+    Returns None when hyperscan is not installed or rejects a pattern; _BLOCKED_RE is used then.
+    """
+    try:
+        import hyperscan
+    except ImportError:
+        return None
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[p.encode() for p in _BLOCKED_PATTERNS],
+            ids=list(range(len(_BLOCKED_PATTERNS))),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(_BLOCKED_PATTERNS),
+        )
+    except Exception:
+        return None
+    return db, hyperscan.ScanTerminated
+
+
+_BLOCKED_DB = _compile_blocked_db()
+# A Hyperscan database scans with one scratch space, which must not be shared between threads.
+_BLOCKED_DB_LOCK = threading.Lock()
+
+
 def _is_dangerous(cmd: str) -> bool:
     """Return True if the command looks dangerous and should be blocked."""
-    return bool(_BLOCKED_RE.search(cmd))
+    if _BLOCKED_DB is None:
+        return bool(_BLOCKED_RE.search(cmd))
+    db, scan_terminated = _BLOCKED_DB
+    matched = False
+
+    def on_match(*_):
+        nonlocal matched
+        matched = True
+        return True  # stop at the first hit
+
+    try:
+        with _BLOCKED_DB_LOCK:
+            db.scan(cmd.encode("utf-8", "surrogateescape"), match_event_handler=on_match)
+    except scan_terminated:
+        pass
+    return matched
+
+
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+
+def _open_for_write(abs_path: str) -> int:
+    """Open abs_path for overwriting, creating the parent directory if needed."""
+    try:
+        return os.open(abs_path, _WRITE_FLAGS, 0o644)
+    except FileNotFoundError:  # parent directory missing: create it only then
+        os.makedirs(os.path.dirname(abs_path) or ".", exist_ok=True)
+        return os.open(abs_path, _WRITE_FLAGS, 0o644)
+
+
+def _write_bytes(abs_path: str, data: bytes | memoryview) -> None:
+    """Write data to abs_path straight through the fd."""
+    view = memoryview(data)
+    fd = _open_for_write(abs_path)
+    try:
+        written = 0
+        while written < len(view):
+            written += os.write(fd, view[written:])
+    finally:
+        os.close(fd)
+
+
+_COPY_CHUNK = 1 << 30  # bytes per copy_file_range call
+
+
+def _copy_file(src_path: str, abs_path: str) -> int:
+    """
+    Copy src_path to abs_path inside the kernel: copy_file_range where available, else
+    shutil.copyfile (sendfile on Linux, fcopyfile on macOS). Returns the bytes copied.
+    """
+    if hasattr(os, "copy_file_range"):
+        src_fd = os.open(src_path, _READ_FLAGS)
+        try:
+            dst_fd = _open_for_write(abs_path)
+            try:
+                copied = 0
+                try:
+                    while n := os.copy_file_range(src_fd, dst_fd, _COPY_CHUNK):
+                        copied += n
+                    return copied
+                except OSError:  # e.g. EXDEV/ENOSYS on older kernels
+                    if copied:
+                        raise
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    os.makedirs(os.path.dirname(abs_path) or ".", exist_ok=True)
+    shutil.copyfile(src_path, abs_path)
+    return os.path.getsize(abs_path)
+
+
+def _encode_content(content: str) -> bytes:
+    if os.linesep != "\n":  # same newline translation as a text-mode write
+        content = content.replace("\n", os.linesep)
+    return content.encode("utf-8")
 
 
-def write_file(args: str) -> str:
+def write_file(args: str) -> tuple[int, str]:
     """
     Write content to a file. Args format: "path|content".
     Supports ~ for user home (e.g. ~/Desktop/file.txt).
+    Use "path|@source_path" to copy an existing file instead.
     """
     try:
-        parts = args.split("|", 1)
-        if len(parts) < 2:
-            return "Error: write_file requires args in format path|content"
-        raw_path, content = parts[0].strip(), parts[1]
-        path = os.path.expanduser(raw_path)
+        sep = args.find("|")
+        if sep < 0:
+            return ERR, "Error: write_file requires args in format path|content"
+        raw_path = args[:sep]
+        path = os.path.expanduser(raw_path.strip())
         abs_path = os.path.abspath(path)
         print(f"[write_file] absolute path: {abs_path}")
-        os.makedirs(os.path.dirname(abs_path) or ".", exist_ok=True)
-        with open(abs_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        return f"Wrote {len(content)} characters to {abs_path}"
+        _read_cache_drop(abs_path)
+        if args.startswith("@", sep + 1) and "\n" not in args[sep + 2 :]:
+            src_path = os.path.abspath(os.path.expanduser(args[sep + 2 :].strip()))
+            # Only an existing file counts: literal content may start with "@" too.
+            if os.path.isfile(src_path):
+                if os.path.realpath(src_path) == os.path.realpath(abs_path):
+                    return ERR, "Error: write_file source and destination are the same file"
+                copied = _copy_file(src_path, abs_path)
+                return OK, f"Copied {copied} bytes from {src_path} to {abs_path}"
+        # Encode once and write the bytes straight to the fd (no buffered/text IO layers).
+        if os.linesep == "\n":
+            # View the content inside the encoded args ("|" is one byte): the content str
+            # (possibly megabytes) is never sliced out and copied. ASCII args (a flag check,
+            # and encoded by a plain copy) map characters to bytes 1:1, so the path needs no encoding.
+            offset = sep + 1 if args.isascii() else len(raw_path.encode("utf-8")) + 1
+            data = memoryview(args.encode("utf-8"))[offset:]
+        else:
+            data = _encode_content(args[sep + 1 :])
+        _write_bytes(abs_path, data)
+        return OK, f"Wrote {len(data)} bytes to {abs_path}"
     except Exception as e:
-        return f"Error writing file: {e}"
+        return ERR, f"Error writing file: {e}"
+
+
+# ---- Batched writes through io_uring (Linux, optional liburing) ----
+_URING_BATCH = 64  # files per submission; each takes 3 SQEs (open, write, close) and one fixed-file slot
+_uring_state: list = []  # [(liburing, ring)] once set up, [None] where io_uring is unavailable
+_uring_lock = threading.Lock()  # one ring, shared by the tool threads
+# SQPOLL: a kernel thread polls the submission queue, so submitting needs no io_uring_enter.
+# Opt-in: write_files still enters the kernel to wait for its completions, and the poll thread
+# competes with the agent for CPU (measured slower on a single core).
+_URING_SQPOLL = os.environ.get("KYROZEN_SQPOLL") == "1"
+
+
+def _uring():
+    """(liburing module, ring) for batched writes, set up on first use; None if unavailable."""
+    if not _uring_state:
+        try:
+            import liburing
 
+            ring = None
+            if _URING_SQPOLL:
+                try:
+                    ring = liburing.Ring()
+                    liburing.io_uring_queue_init(_URING_BATCH * 4, ring, liburing.IORING_SETUP_SQPOLL)
+                except OSError:  # before Linux 5.11 SQPOLL needs CAP_SYS_NICE
+                    ring = None
+            if ring is None:
+                ring = liburing.Ring()
+                liburing.io_uring_queue_init(_URING_BATCH * 4, ring)
+            liburing.io_uring_register_files_sparse(ring, _URING_BATCH)
+            try:  # Linux 5.18+: io_uring_enter uses the registered ring fd, no fd lookup per submit
+                liburing.io_uring_register_ring_fd(ring)
+            except OSError:
+                pass
+            _uring_state.append((liburing, ring))
+        except Exception:  # not installed, not Linux, or io_uring disabled (e.g. seccomp)
+            _uring_state.append(None)
+    return _uring_state[0]
 
-def read_file(args: str) -> str:
+
+def _uring_write_batch(uring, ring, batch: list[tuple[str, bytes]]) -> list[tuple[str, bytes]]:
+    """
+    Write every (abs_path, data) of batch in one submission: per file a linked openat2 into fixed
+    slot i, write and close. Returns the entries that failed at any step (retried serially).
+    """
+    how = uring.OpenHow(_WRITE_FLAGS, 0o644)  # must stay alive until the submission completes
+    for i, (abs_path, data) in enumerate(batch):
+        sqe = uring.io_uring_get_sqe(ring)
+        uring.io_uring_prep_openat2_direct(sqe, abs_path, how, i)
+        uring.io_uring_sqe_set_flags(sqe, uring.IOSQE_IO_LINK)
+        sqe.user_data = 3 * i
+        sqe = uring.io_uring_get_sqe(ring)
+        uring.io_uring_prep_write(sqe, i, data, 0)
+        # Hard link: the slot is closed even if the write fails.
+        uring.io_uring_sqe_set_flags(sqe, uring.IOSQE_IO_HARDLINK | uring.IOSQE_FIXED_FILE)
+        sqe.user_data = 3 * i + 1
+        sqe = uring.io_uring_get_sqe(ring)
+        uring.io_uring_prep_close_direct(sqe, i)
+        sqe.user_data = 3 * i + 2
+    uring.io_uring_submit_and_wait(ring, 3 * len(batch))
+    failed: set[int] = set()
+    cqe = uring.Cqe()
+    for _ in range(3 * len(batch)):
+        uring.io_uring_wait_cqe(ring, cqe)
+        entry = cqe[0]
+        i, step = divmod(entry.user_data, 3)
+        try:
+            res = entry.res  # raises OSError for a failed (or cancelled) operation
+            if step == 1 and res != len(batch[i][1]):
+                failed.add(i)  # short write
+        except OSError:
+            failed.add(i)
+        uring.io_uring_cqe_seen(ring, entry)
+    return [batch[i] for i in sorted(failed)]
+
+
+def write_files(args: str) -> tuple[int, str]:
+    """
+    Write several files in one call. Args format: a JSON object mapping each path to its content,
+    e.g. {"src/a.py": "print(1)", "src/b.py": "print(2)"}. Supports ~ for user home.
+    """
+    try:
+        files = json.loads(args)
+    except ValueError as e:
+        return ERR, f"Error: write_files requires a JSON object of path: content ({e})"
+    if not isinstance(files, dict) or not files or not all(isinstance(c, str) for c in files.values()):
+        return ERR, "Error: write_files requires a non-empty JSON object of path: content strings"
+    try:
+        # Keyed by absolute path: two spellings of one file must not be written concurrently.
+        entries = {
+            os.path.abspath(os.path.expanduser(path.strip())): _encode_content(content)
+            for path, content in files.items()
+        }
+    except Exception as e:
+        return ERR, f"Error writing files: {e}"
+    print(f"[write_files] writing {len(entries)} files")
+    for abs_path in entries:
+        _read_cache_drop(abs_path)
+    pending = list(entries.items())
+    with _uring_lock:
+        state = _uring()
+        if state is not None:
+            try:
+                pending = [
+                    entry
+                    for start in range(0, len(pending), _URING_BATCH)
+                    for entry in _uring_write_batch(*state, pending[start : start + _URING_BATCH])
+                ]
+            except Exception:  # ring left in an unknown state: stop using it, rewrite everything
+                _uring_state[0] = None
+                pending = list(entries.items())
+    # Serial path: no io_uring, or files whose batched write failed (e.g. a missing directory).
+    errors = []
+    for abs_path, data in pending:
+        try:
+            _write_bytes(abs_path, data)
+        except Exception as e:
+            errors.append(f"{abs_path}: {e}")
+    if errors:
+        return ERR, f"Error writing files: {'; '.join(errors)}"
+    return OK, f"Wrote {len(entries)} files ({sum(map(len, entries.values()))} bytes)"
+
+
+_READ_MMAP_MIN = 64 * 1024  # files larger than this are read through mmap
+_READ_LIMIT = 256 * 1024  # bytes of a large file returned to the model
+_READ_CHUNK = 64 * 1024  # os.read() size when the total length is not known up front
+
+
+_READ_FLAGS = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+_O_NOATIME = getattr(os, "O_NOATIME", 0)  # Linux: no atime update (write-back) for reads
+
+
+def _open_for_read(abs_path: str) -> int:
+    """Open for reading, with O_NOATIME where allowed (only the file's owner may set it)."""
+    if _O_NOATIME:
+        try:
+            return os.open(abs_path, _READ_FLAGS | _O_NOATIME)
+        except PermissionError:
+            pass
+    return os.open(abs_path, _READ_FLAGS)
+
+
+def _read_to_end(fd: int, size: int) -> bytes:
+    """Read fd until EOF; size (from fstat) is the first read's length, 0 for e.g. /proc files."""
+    chunks = []
+    while chunk := os.read(fd, size or _READ_CHUNK):
+        chunks.append(chunk)
+        size = _READ_CHUNK
+    return b"".join(chunks)
+
+
+def read_file(args: str) -> tuple[int, str]:
     """
     Read content from a file. Args format: "path".
     Supports ~ for user home.
@@ -59,47 +340,436 @@ def read_file(args: str) -> str:
     try:
         raw_path = args.strip()
         if not raw_path:
-            return "Error: read_file requires a path"
+            return ERR, "Error: read_file requires a path"
         path = os.path.expanduser(raw_path)
         abs_path = os.path.abspath(path)
-        with open(abs_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        return f"Error: file not found: {os.path.abspath(os.path.expanduser(args.strip()))}"
+        cached = _read_cache_get(abs_path)
+        if cached is not None:
+            return OK, cached
+        # Raw fd reads: no BufferedReader/TextIOWrapper layers, one read() for a small file.
+        fd = _open_for_read(abs_path)
+        try:
+            st = os.fstat(fd)
+            size = st.st_size
+            truncated = size > _READ_LIMIT
+            nbytes = size  # bytes actually read, for the cache check; mmap maps exactly size
+            if size <= _READ_MMAP_MIN:
+                data = _read_to_end(fd, size)
+                nbytes = len(data)
+                text = data.decode("utf-8")
+            else:
+                # Large file: map it and decode at most _READ_LIMIT bytes, front to back.
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)  # larger readahead window
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    # Decoded straight from the mapped pages, no intermediate bytes copy. Not final
+                    # when truncated: a character cut off at the limit is dropped, not an error.
+                    text = codecs.utf_8_decode(view[:_READ_LIMIT], "strict", not truncated)[0]
+        finally:
+            os.close(fd)
+        if "\r" in text:  # same newline handling as a text-mode read
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if truncated:
+            text += f"\n...[truncated: first {_READ_LIMIT} of {size} bytes shown]"
+        _read_cache_put(abs_path, st, text, nbytes)
+        return OK, text
+    except FileNotFoundError as e:  # the open is the existence check; no separate stat
+        return ERR, f"Error: file not found: {e.filename}"
     except Exception as e:
-        return f"Error reading file: {e}"
+        return ERR, f"Error reading file: {e}"
+
 
+# Recently read files: absolute path -> (mtime_ns, size, inode, text), validated by one stat().
+# Files modified within the last couple of seconds are not cached: a second write in the same
+# mtime tick that keeps the size would otherwise go unnoticed. write_file/write_files drop entries.
+# Pseudo-filesystems are never cached: their files keep a fixed mtime and size while the content
+# changes (/proc reports size 0, sysfs 4096), so the stat check could not see the change.
+_READ_CACHE_SKIP = ("/proc/", "/sys/", "/dev/")
+_READ_CACHE_CHARS = 32 * 1024 * 1024  # total length of cached text
+_READ_CACHE_MIN_AGE_NS = 2_000_000_000
+_read_cache: OrderedDict[str, tuple[int, int, int, str]] = OrderedDict()
+_read_cache_chars = [0]
+_read_cache_lock = threading.Lock()
 
-def run_cmd(args: str) -> str:
+
+def _read_cache_get(abs_path: str) -> str | None:
+    """Cached text for abs_path if the file is unchanged since it was read, else None."""
+    if abs_path not in _read_cache:  # a miss costs no stat: the open that follows checks existence
+        return None
+    try:
+        st = os.stat(abs_path)
+    except OSError:
+        return None
+    with _read_cache_lock:
+        entry = _read_cache.get(abs_path)
+        if entry is None or entry[:3] != (st.st_mtime_ns, st.st_size, st.st_ino):
+            return None
+        _read_cache.move_to_end(abs_path)
+        return entry[3]
+
+
+def _read_cache_put(abs_path: str, st: os.stat_result, text: str, nbytes: int) -> None:
     """
-    Execute a shell command. Args: the full command string.
-    Blocks dangerous operations (e.g. rm -rf).
+    Cache a regular file's text under the stat it was read with, evicting least recently used.
+    Only when the nbytes actually read match the stat size: a file whose size does not describe
+    its content (a pseudo-file) would otherwise be served stale.
     """
-    cmd = args.strip()
-    if not cmd:
-        return "Error: run_cmd requires a command"
-    if _is_dangerous(cmd):
-        return "Error: command blocked for safety (e.g. rm -rf or similar)."
+    if (
+        not stat.S_ISREG(st.st_mode)
+        or not 0 < st.st_size == nbytes
+        or time.time_ns() - st.st_mtime_ns < _READ_CACHE_MIN_AGE_NS
+        or os.path.realpath(abs_path).startswith(_READ_CACHE_SKIP)
+    ):
+        return
+    with _read_cache_lock:
+        old = _read_cache.pop(abs_path, None)
+        if old is not None:
+            _read_cache_chars[0] -= len(old[3])
+        _read_cache[abs_path] = (st.st_mtime_ns, st.st_size, st.st_ino, text)
+        _read_cache_chars[0] += len(text)
+        while _read_cache_chars[0] > _READ_CACHE_CHARS:
+            _read_cache_chars[0] -= len(_read_cache.popitem(last=False)[1][3])
+
+
+def _read_cache_drop(abs_path: str) -> None:
+    """Forget abs_path (it is about to be written)."""
+    with _read_cache_lock:
+        old = _read_cache.pop(abs_path, None)
+        if old is not None:
+            _read_cache_chars[0] -= len(old[3])
+
+
+_RWF_NOWAIT = getattr(os, "RWF_NOWAIT", 0)  # Linux 4.14+: fail with EAGAIN instead of waiting for disk
+
+
+def read_file_nowait(args: str) -> tuple[int, str] | None:
+    """
+    read_file for a small file whose data is already in the page cache, without ever blocking
+    on disk (preadv2 with RWF_NOWAIT). None when that is not possible; use read_file then.
+    """
+    if not _RWF_NOWAIT:
+        return None
     try:
+        abs_path = os.path.abspath(os.path.expanduser(args.strip()))
+        cached = _read_cache_get(abs_path)
+        if cached is not None:
+            return OK, cached
+        fd = _open_for_read(abs_path)
+        try:
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode) or not 0 < st.st_size <= _READ_MMAP_MIN:
+                return None
+            buf = bytearray(st.st_size)
+            if os.preadv(fd, [buf], 0, _RWF_NOWAIT) != st.st_size:
+                return None  # only partly cached (or the file changed)
+        finally:
+            os.close(fd)
+        text = buf.decode("utf-8")
+    except (OSError, ValueError):  # EAGAIN (not cached), EOPNOTSUPP, decode errors, ...
+        return None
+    if "\r" in text:  # same newline handling as read_file
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    _read_cache_put(abs_path, st, text, st.st_size)
+    return OK, text
+
+
+# Anything the shell would interpret (pipes, redirects, expansions, globs, VAR=value prefixes).
+_SHELL_SYNTAX_RE = re.compile(r"[|&;<>()$`\\*?\[\]{}~!#\n]|^\s*\w+=")
+
+
+def _direct_argv(cmd: str) -> list[str] | None:
+    """argv for running cmd without a shell, or None when it needs one (shell syntax, unbalanced quotes)."""
+    if _SHELL_SYNTAX_RE.search(cmd):
+        return None
+    try:
+        return shlex.split(cmd) or None
+    except ValueError:
+        return None
+
+
+_SHELL = "/bin/sh"
+_program_paths: dict[str, str] = {}  # PATH lookups for bare program names
+
+
+def _resolve_program(name: str) -> str | None:
+    """Absolute path of the program argv[0] names, or None if it is not found."""
+    path = _program_paths.get(name)
+    if path is None:
+        path = shutil.which(name)
+        if path is None:
+            return None
+        path = os.path.abspath(path)
+        if os.path.basename(name) == name:  # relative paths depend on the cwd; not cached
+            _program_paths[name] = path
+    return path
+
+
+_CMD_TIMEOUT = 60  # seconds
+_OUTPUT_LIMIT = 256 * 1024  # bytes of command output kept; the rest is drained and counted
+
+
+def _run(cmd: str) -> tuple[int, str]:
+    """
+    Run cmd directly when it needs no shell, else in the persistent shell; returns (exit code, output).
+    The direct launch passes an absolute executable and close_fds=False, which lets CPython use
+    posix_spawn (vfork) instead of fork + exec; fds Python opens are non-inheritable anyway (PEP 446).
+    """
+    if os.name == "nt":  # cmd.exe builtins and quoting do not follow POSIX shlex; no select() on pipes
         result = subprocess.run(
             cmd,
             shell=True,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True,
-            timeout=60,
+            errors="replace",
+            timeout=_CMD_TIMEOUT,
         )
-        out = result.stdout or ""
-        err = result.stderr or ""
-        if result.returncode != 0:
-            return f"Exit code {result.returncode}\nstdout:\n{out}\nstderr:\n{err}".strip()
-        return out.strip() or "(no output)"
+        return result.returncode, result.stdout or ""
+    argv = _direct_argv(cmd)
+    program = _resolve_program(argv[0]) if argv else None
+    if program is None:  # shell syntax, a builtin such as cd, or an unknown program
+        return _run_shell(cmd)
+    try:
+        return _spawn(argv, program)
+    except FileNotFoundError:  # removed since it was looked up
+        _program_paths.pop(argv[0], None)
+        return _run_shell(cmd)
+
+
+def _spawn(argv: list[str], program: str) -> tuple[int, str]:
+    """
+    Run argv with stderr merged into stdout (one pipe), reading output as it arrives into a
+    bytearray capped at _OUTPUT_LIMIT and decoding it once at the end.
+    """
+    proc = subprocess.Popen(
+        argv,
+        executable=program,
+        close_fds=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=0,
+    )
+    out = bytearray()
+    dropped = 0
+    fd = proc.stdout.fileno()
+    deadline = time.monotonic() + _CMD_TIMEOUT
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise subprocess.TimeoutExpired(argv, _CMD_TIMEOUT)
+            chunk = os.read(fd, _READ_CHUNK)
+            if not chunk:
+                break
+            kept = chunk[: max(_OUTPUT_LIMIT - len(out), 0)]
+            out += kept
+            dropped += len(chunk) - len(kept)
+        returncode = _wait(proc, deadline)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        proc.stdout.close()
+    return returncode, _decode_output(out, dropped)
+
+
+def _wait(proc: subprocess.Popen, deadline: float) -> int:
+    """
+    proc.wait() with a deadline. Popen.wait(timeout) polls waitpid with growing sleeps, so where
+    pidfd_open exists (Linux 5.3+) block on the process's pidfd until it exits, then reap once.
+    """
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):  # older kernel/Python, or not Linux
+        return proc.wait(timeout=max(deadline - time.monotonic(), 0))
+    try:
+        if not select.select([pidfd], [], [], max(deadline - time.monotonic(), 0))[0]:
+            raise subprocess.TimeoutExpired(proc.args, _CMD_TIMEOUT)
+    finally:
+        os.close(pidfd)
+    return proc.wait()
+
+
+def _decode_output(out: bytearray, dropped: int) -> str:
+    """Command output as text, with a note for the bytes dropped past _OUTPUT_LIMIT."""
+    text = out.decode("utf-8", "replace").replace("\r\n", "\n")
+    if dropped:
+        text += f"\n...[truncated: {dropped} more bytes of output]"
+    return text
+
+
+# Shell commands go to one long-lived "/bin/sh -s" fed over stdin, so only the first pays for
+# starting a shell. Each command is followed by a printf of a per-worker random marker and its
+# exit status. The worker is its own process group, so a timeout kills the command with it.
+_shell_state: list = []  # [(Popen, marker)] while a worker is running
+_shell_lock = threading.Lock()  # one command in flight per worker
+
+
+def _shell_worker() -> tuple[subprocess.Popen, bytes]:
+    """The running shell worker and its end marker, started if there is none."""
+    if _shell_state and _shell_state[0][0].poll() is None:
+        return _shell_state[0]
+    proc = subprocess.Popen(
+        [_SHELL, "-s"],
+        executable=_SHELL,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=0,
+        start_new_session=True,
+    )
+    worker = (proc, f"\n__end_{os.urandom(8).hex()}__ ".encode())
+    _shell_state[:] = [worker]
+    return worker
+
+
+def _stop_shell(proc: subprocess.Popen) -> None:
+    """Kill a shell worker and whatever it is running, and forget it if it is the current one."""
+    if _shell_state and _shell_state[0][0] is proc:
+        _shell_state.clear()
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:  # already gone
+        pass
+    proc.wait()
+    proc.stdin.close()
+    proc.stdout.close()
+
+
+def run_cmd_reset() -> None:
+    """Kill the persistent shell and anything it is running; the next shell command starts a fresh one."""
+    if _shell_state:
+        _stop_shell(_shell_state[0][0])
+
+
+# A lone "&" (not "&&", ">&", "&>"): a background job would keep writing to the worker's stdout
+# after its command returned, into the output of later commands. Quoted "&"s match too (harmless).
+_BACKGROUND_RE = re.compile(r"(?<![&>|<])&(?![&>])")
+
+
+def _run_shell(cmd: str) -> tuple[int, str]:
+    """
+    Run cmd in the shell worker, or in a one-off /bin/sh -c when it starts background jobs or
+    another thread is using the worker.
+    """
+    if _BACKGROUND_RE.search(cmd) or not _shell_lock.acquire(blocking=False):
+        return _spawn([_SHELL, "-c", cmd], _SHELL)
+    try:
+        proc, marker = _shell_worker()
+        if not _drain_shell(proc):  # the worker died since the last command
+            _stop_shell(proc)
+            proc, marker = _shell_worker()
+        try:
+            return _shell_exec(proc, marker, cmd)
+        except BrokenPipeError:  # the worker exited before reading the command
+            _stop_shell(proc)
+            return _spawn([_SHELL, "-c", cmd], _SHELL)
+    finally:
+        _shell_lock.release()
+
+
+def _drain_shell(proc: subprocess.Popen) -> bool:
+    """
+    Discard output that reached the worker between commands (e.g. from a process that daemonized
+    itself and kept stdout), so it is not reported as the next command's. False if the worker is gone.
+    """
+    fd = proc.stdout.fileno()
+    while select.select([fd], [], [], 0)[0]:
+        if not os.read(fd, _READ_CHUNK):
+            return False
+    return True
+
+
+def _shell_exec(proc: subprocess.Popen, marker: bytes, cmd: str) -> tuple[int, str]:
+    """
+    Send cmd to the worker and read its merged output up to the end marker, with the same
+    timeout and output cap as _spawn. The command is one quoted word passed to eval, so a
+    syntax error (an unterminated quote or heredoc) cannot swallow the marker line after it.
+    It runs in a subshell from Python's current directory, with stdin from /dev/null (so it
+    cannot consume the commands that follow): variables, aliases, functions, traps, set
+    options and exit do not carry over into later commands, as with a fresh sh -c. The
+    subshell is a fork of the already-running shell, with no exec or shell start-up.
+    """
+    status = marker[1:-1].decode()
+    script = (
+        f"cd -- {shlex.quote(os.getcwd())}\n"
+        f"(eval {shlex.quote(cmd)}) </dev/null\n"
+        f"printf '\\n{status} %d\\n' \"$?\"\n"
+    )
+    data = memoryview(script.encode("utf-8", "surrogateescape"))
+    out = bytearray()
+    dropped = 0
+    end = -1
+    keep_tail = len(marker) + 16  # room for a marker split across reads
+    fd = proc.stdout.fileno()
+    deadline = time.monotonic() + _CMD_TIMEOUT
+    try:
+        while data:
+            data = data[os.write(proc.stdin.fileno(), data) :]
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise subprocess.TimeoutExpired(cmd, _CMD_TIMEOUT)
+            chunk = os.read(fd, _READ_CHUNK)
+            if not chunk:  # the worker itself died (killed from outside, or run_cmd_reset())
+                returncode = proc.wait(timeout=max(deadline - time.monotonic(), 0))
+                _stop_shell(proc)
+                break
+            if end < 0:
+                start = max(len(out) - len(marker), 0)
+                out += chunk
+                end = out.find(marker, start)
+            else:
+                out += chunk
+            if end >= 0:
+                eol = out.find(b"\n", end + len(marker))
+                if eol >= 0:
+                    returncode = int(out[end + len(marker) : eol])
+                    del out[end:]
+                    break
+            elif len(out) > _OUTPUT_LIMIT + keep_tail:
+                excess = len(out) - _OUTPUT_LIMIT - keep_tail
+                del out[_OUTPUT_LIMIT : _OUTPUT_LIMIT + excess]
+                dropped += excess
+    except BaseException:
+        _stop_shell(proc)
+        raise
+    if len(out) > _OUTPUT_LIMIT:
+        dropped += len(out) - _OUTPUT_LIMIT
+        del out[_OUTPUT_LIMIT:]
+    return returncode, _decode_output(out, dropped)
+
+
+def run_cmd(args: str) -> tuple[int, str]:
+    """
+    Execute a shell command. Args: the full command string.
+    Blocks dangerous operations (e.g. rm -rf).
+    """
+    cmd = args.strip()
+    if not cmd:
+        return ERR, "Error: run_cmd requires a command"
+    if _is_dangerous(cmd):
+        return BLOCKED, "Error: command blocked for safety (e.g. rm -rf or similar)."
+    try:
+        returncode, out = _run(cmd)
+        if returncode != 0:
+            return OK, f"Exit code {returncode}\noutput:\n{out}".strip()
+        return OK, out.strip() or "(no output)"
     except subprocess.TimeoutExpired:
-        return "Error: command timed out after 60s"
+        return ERR, f"Error: command timed out after {_CMD_TIMEOUT}s"
     except Exception as e:
-        return f"Error running command: {e}"
+        return ERR, f"Error running command: {e}"
 
 
-def search_web(args: str) -> str:
+# Recent search results by normalised query: retries and follow-ups often repeat a search.
+_SEARCH_CACHE_SIZE = 128
+_SEARCH_CACHE_TTL = 300.0  # seconds
+_search_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+
+def search_web(args: str) -> tuple[int, str]:
     """
     Search the internet for real-time information.
     Args format: "query" (e.g., "latest bitcoin price", "who won the super bowl").
@@ -107,30 +777,49 @@ def search_web(args: str) -> str:
     """
     query = (args or "").strip()
     if not query:
-        return "Search Error: query is empty."
+        return OK, "Search Error: query is empty."
+
+    key = " ".join(query.split()).casefold()
+    now = time.monotonic()
+    with _search_cache_lock:
+        hit = _search_cache.get(key)
+        if hit and now - hit[0] < _SEARCH_CACHE_TTL:
+            _search_cache.move_to_end(key)
+            return OK, hit[1]
 
     try:
+        from duckduckgo_search import DDGS  # imported on first search, not at startup
+
         ddgs = DDGS()
         results = list(ddgs.text(query, max_results=3))
     except Exception as e:
-        # Log to console; do not crash. Return a clear message for the agent.
+        # Log to console; do not crash. Return a clear message for the agent. ERR status: a
+        # transient failure, so it is neither memoized as a result nor treated as one.
         print(f"[search_web] DDGS error (rate limit/network): {e}", flush=True)
-        return f"Search temporarily unavailable: {e}. Please try again or rephrase the query."
+        return ERR, f"Search temporarily unavailable: {e}. Please try again or rephrase the query."
 
     if not results:
-        return "No search results found. Please try a different query."
+        return OK, "No search results found. Please try a different query."
 
     lines = []
     for r in results:
         title = r.get("title", "")
         snippet = r.get("body", "")
         lines.append(f"- Title: {title}\n  Snippet: {snippet}")
-    return "\n\n".join(lines)
+    text = "\n\n".join(lines)
+    with _search_cache_lock:
+        _search_cache[key] = (now, text)
+        _search_cache.move_to_end(key)
+        if len(_search_cache) > _SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+    return OK, text
 
 
-AVAILABLE_TOOLS: dict[str, Any] = {
+# Read-only view: the table is fixed at import, so callers can keep references to it.
+AVAILABLE_TOOLS: Mapping[str, Any] = MappingProxyType({
     "write_file": write_file,
+    "write_files": write_files,
     "read_file": read_file,
     "run_cmd": run_cmd,
     "search_web": search_web,
-}
+})